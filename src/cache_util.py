@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# cache_util.py: simple on-disk cache for intermediate results, such as
+# pre-processed graphs, that are expensive to create but do not change
+# between runs of a script.
+
+import hashlib
+import logging
+import os
+import tempfile
+
+import joblib
+
+# Increase this whenever the pre-processing of graphs changes in order
+# to invalidate all existing cache entries.
+CACHE_VERSION = 2
+
+
+def cache_filename(directory, *key):
+    '''
+    Returns the filename of a cache entry. The entry is identified by
+    a hash of its key, which should comprise everything the cached data
+    depends on.
+
+    :param directory: Directory in which to store the cache
+    :param key: Values identifying the entry; must have a stable `repr`
+    :return: Filename of the cache entry
+    '''
+
+    digest = hashlib.sha1(repr((CACHE_VERSION,) + key).encode()).hexdigest()
+    return os.path.join(directory, '.cache', f'{digest}.joblib')
+
+
+def file_key(filenames):
+    '''
+    Creates a cache key for a list of input files. Modification times
+    are part of the key so that changed inputs invalidate the cache.
+
+    :param filenames: List of input files
+    :return: Tuple of filenames and modification times
+    '''
+
+    return tuple(
+        (filename, os.path.getmtime(filename)) for filename in filenames
+    )
+
+
+def load_or_create(filename, f, use_cache=True):
+    '''
+    Loads data from a cache entry or creates it and stores it in the
+    cache. The entry is written atomically, so concurrent jobs working
+    on the same data set never see a partially-written file.
+
+    :param filename: Filename of the cache entry
+    :param f: Function without arguments that creates the data
+    :param use_cache: If not set, always creates the data and does not
+    touch the cache at all
+    :return: Cached or newly-created data
+    '''
+
+    if not use_cache:
+        return f()
+
+    if os.path.exists(filename):
+        logging.info(f'Loading cached data from {filename}')
+        return joblib.load(filename)
+
+    data = f()
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    # The temporary file has a unique name, even if jobs on different
+    # hosts write to the same shared directory.
+    fd, tmp_filename = tempfile.mkstemp(
+        suffix='.tmp', dir=os.path.dirname(filename)
+    )
+
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            joblib.dump(data, tmp_file, compress=0)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+
+    return data
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+#
+# convert_to_arrays.py: converts a data set, stored as one `picklez`
+# file per graph, into a single `.npz` file of flat arrays. The scripts
+# for creating kernel matrices accept such a file instead of the graph
+# files, which is much faster to load. Only labels are converted, so
+# kernels that require vertex attributes still need the graph files.
+#
+# Graphs are stored in the order of the input, and graphs are sampled by
+# their position. A directory is therefore listed in the same order as
+# `grakel_create_kernel_matrices.py` lists it, whereas a list of files
+# is kept in the given order, as in `create_kernel_matrices.py`.
+
+import argparse
+import os
+
+import numpy as np
+
+from graph_io import graphs_to_arrays
+from graph_io import list_graph_files
+from graph_io import read_graphs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'FILE',
+        nargs='+',
+        type=str,
+        help='Input file(s) or a directory of graph files'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        required=True,
+        type=str,
+        help='Output file'
+    )
+
+    args = parser.parse_args()
+
+    if len(args.FILE) == 1 and os.path.isdir(args.FILE[0]):
+        filenames = list_graph_files(args.FILE[0])
+    else:
+        filenames = args.FILE
+
+    graphs = read_graphs(filenames)
+    np.savez(args.output, **graphs_to_arrays(graphs))
@@ -8,17 +8,23 @@
 import argparse
 import logging
 import os
-import random
 import sys
 import traceback
 
 import graphkernels.kernels as gk
-import igraph as ig
 import numpy as np
 
+from joblib import Parallel, delayed, effective_n_jobs
 from timeit import time
 from tqdm import tqdm
 
+from cache_util import cache_filename, file_key, load_or_create
+from graph_io import read_sample
+from kernel_util import edge_histogram_kernel
+from kernel_util import save_matrices
+from kernel_util import vertex_histogram_kernel
+from kernel_util import weisfeiler_lehman_sweep
+
 
 def preprocess(graph):
     '''
@@ -46,6 +52,94 @@ def preprocess(graph):
     return graph
 
 
+def load_graphs(filenames, n_graphs, same_size=False, timing=False):
+    '''
+    Loads and pre-processes the graphs of a data set. If the data set
+    is larger than `n_graphs`, a random subset of graphs is used.
+
+    :param filenames: Input files, one per graph
+    :param n_graphs: Maximum number of graphs to use
+    :param same_size: If set, only uses graphs of the most common size
+    :param timing: If set, uses at most 100 graphs for measuring run times
+    :return: List of pre-processed graphs
+    '''
+
+    graphs = read_sample(filenames, n_graphs, same_size, timing)
+
+    return [
+        preprocess(graph) for graph in tqdm(graphs, desc='Preprocessing')
+    ]
+
+
+def compute_matrices(
+    algorithm, f, params, graphs, y, filename, timing, sweep=False
+):
+    '''
+    Applies a graph kernel to a list of graphs and stores the resulting
+    kernel matrices as well as the time required to calculate them. The
+    function is self-contained so that it can run in a worker process.
+
+    :param algorithm: Name of the algorithm
+    :param f: Function to apply to the list of graphs in order to obtain
+    a kernel matrix
+    :param params: Parameter grid of the algorithm; can be `None` if the
+    algorithm does not have any parameters
+    :param graphs: List of pre-processed graphs
+    :param y: Label vector of the graph data set
+    :param filename: Output filename for the kernel matrices
+    :param timing: If set, only stores timing information
+    :param sweep: If set, `f` evaluates the whole parameter grid in a
+    single call and returns one kernel matrix per parameter
+    '''
+
+    start_time = time.process_time()
+
+    if params is not None:
+        try:
+            if sweep:
+                matrices = dict(zip(map(str, params), f(graphs, params)))
+            else:
+                matrices = {
+                    str(param): f(graphs, par=param)
+                    for param in params
+                }
+        except NotImplementedError:
+            logging.warning(f'''
+Caught exception for {algorithm}; continuing with the next algorithm and
+its corresponding parameter grid.
+            ''')
+
+            traceback.print_exc()
+            return
+
+        # Store the label vector of the graph data set along with
+        # the set of matrices.
+        matrices['y'] = y
+
+        # We only save matrices if we are not in timing mode. In
+        # some sense, the calculations will thus be lost, but we
+        # should not account for the save time anyway.
+        if not timing:
+            save_matrices(filename, **matrices)
+
+    else:
+        K = f(graphs)
+
+        # We only save the matrix if we are not in timing mode; see
+        # above for the rationale.
+        if not timing:
+            save_matrices(filename, K=K, y=y)
+
+    stop_time = time.process_time()
+
+    # We overwrite this *all* the time because the information can
+    # always be replaced easily.
+    output = os.path.dirname(filename)
+    time_filename = os.path.join(output, f'Time_{algorithm}.txt')
+    with open(time_filename, 'w') as time_file:
+        print(stop_time - start_time, file=time_file)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('FILE', nargs='+', type=str, help='Input file(s)')
@@ -77,6 +171,18 @@ if __name__ == '__main__':
         action='store_const', const=True, default=False,
         help='todo'
     )
+    parser.add_argument(
+        '-j', '--n-jobs',
+        type=int,
+        default=None,
+        help='Number of algorithms to run in parallel; negative values are '
+             'interpreted as in joblib (default: all; 1 in timing mode)'
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        default=False,
+        help='If specified, does not use cached pre-processed graphs'
+    )
 
     args = parser.parse_args()
 
@@ -90,21 +196,6 @@ if __name__ == '__main__':
     if args.timing:
         logging.info('Choosing at most 100 graphs at random for timing')
 
-        random.seed(42)
-        args.FILE = random.sample(args.FILE, 100)
-
-
-    graphs = [
-        ig.read(filename, format='picklez') for filename in
-        tqdm(args.FILE, desc='File')
-    ]
-
-    if args.same_size:
-        values, counts = np.unique([len(G.vs) for G in graphs], return_counts=True)
-        n_nodes = values[np.argmax(counts)]
-        graphs = [G for G in graphs if len(G.vs) == n_nodes]
-        print(f"Use only graphs of size {n_nodes}")
-
     # Sample graphs
     dataset = args.output.split('/')[-1]
     n_graphs = {
@@ -116,25 +207,37 @@ if __name__ == '__main__':
         'PROTEINS': 200,
         'AIDS': 500,
     }
-    if n_graphs[dataset] < len(graphs):
-        rng = np.random.default_rng(403371)
-        graphs = rng.choice(graphs, n_graphs[dataset], replace=False)
 
-    graphs = [
-        preprocess(graph) for graph in tqdm(graphs, desc='Preprocessing')
-    ]
+    # Loading and pre-processing only depends on the input files and
+    # on the sampling settings, so the result can be cached.
+    graphs = load_or_create(
+        cache_filename(
+            args.output,
+            'create_kernel_matrices',
+            file_key(args.FILE),
+            args.same_size,
+            n_graphs[dataset],
+            args.timing,
+        ),
+        lambda: load_graphs(
+            args.FILE, n_graphs[dataset], args.same_size, args.timing
+        ),
+        use_cache=not args.no_cache
+    )
 
-    y = np.array([g['label'] for g in graphs])
+    y = np.fromiter(
+        (g['label'] for g in graphs), dtype=np.int32, count=len(graphs)
+    )
 
     algorithms = {
         # Histogram kernels (baselines)
-        'VH': gk.CalculateVertexHistKernel,
-        'EH': gk.CalculateEdgeHistKernel,
+        'VH': vertex_histogram_kernel,
+        'EH': edge_histogram_kernel,
         # Other kernels
         'GL': gk.CalculateGraphletKernel,
         'SP': gk.CalculateShortestPathKernel,
         'RW': gk.CalculateExponentialRandomWalkKernel,
-        'WL': gk.CalculateWLKernel,
+        'WL': weisfeiler_lehman_sweep,
         # 'VEH': gk.CalculateVertexEdgeHistKernel,
         # 'VVEH': gk.CalculateVertexVertexEdgeHistKernel,
     }
@@ -145,17 +248,35 @@ if __name__ == '__main__':
         'VVEH': 10.0 * np.arange(-2, 3),  # $l$ = regularisation term
     }
 
-    # Remove algorithms that have not been specified by the user; this
-    # makes it possible to run only a subset of all configurations.
-    algorithms = {
-        k: v for k, v in algorithms.items() if k in args.algorithm
-    }
+    # Algorithms that calculate their whole parameter grid at once. For
+    # WL, the kernel matrix for $h$ iterations is a by-product of the
+    # one for $h + 1$ iterations, so we only need a single refinement.
+    sweeps = ['WL']
 
-    os.makedirs(args.output, exist_ok=True)
+    # Run times are reported for the `graphkernels` implementations, so
+    # they remain comparable to previous measurements. Timing mode does
+    # not store any matrices, so only the implementations that produce
+    # the stored matrices differ.
+    if args.timing:
+        algorithms.update({
+            'VH': gk.CalculateVertexHistKernel,
+            'EH': gk.CalculateEdgeHistKernel,
+            'WL': gk.CalculateWLKernel,
+        })
+        sweeps = []
 
-    for algorithm in sorted(tqdm(algorithms.keys(), desc='Algorithm')):
+    os.makedirs(args.output, exist_ok=True)
 
-        start_time = time.process_time()
+    # Check which algorithms would overwrite an existing output. This
+    # is done before dispatching any of them in order to keep the logs
+    # of the main process readable.
+    #
+    # Only algorithms that have been specified by the user are used; this
+    # makes it possible to run only a subset of all configurations.
+    jobs = []
+    for algorithm in sorted(set(args.algorithm)):
+        if algorithm not in algorithms:
+            continue
 
         # Filename for the current algorithm. We create this beforehand
         # in order to check whether we would overwrite something.
@@ -166,47 +287,30 @@ if __name__ == '__main__':
                 logging.info('Output path already exists. Skipping.')
                 continue
 
-        # Function to apply to the list of graphs in order to obtain
-        # a kernel matrix.
-        f = algorithms[algorithm]
-
-        if algorithm in param_grid.keys():
-            print("still going!")
-            try:
-                matrices = {
-                    str(param): f(graphs, par=param)
-                    for param in param_grid[algorithm]
-                }
-            except NotImplementedError:
-                logging.warning(f'''
-Caught exception for {algorithm}; continuing with the next algorithm and
-its corresponding parameter grid.
-                ''')
-
-                traceback.print_exc()
-                continue
+        jobs.append((algorithm, filename))
 
-            # Store the label vector of the graph data set along with
-            # the set of matrices.
-            matrices['y'] = y
-
-            # We only save matrices if we are not in timing mode. In
-            # some sense, the calculations will thus be lost, but we
-            # should not account for the save time anyway.
-            if not args.timing:
-                np.savez(filename, **matrices)
-
-        else:
-            K = f(graphs)
-
-            # We only save the matrix if we are not in timing mode; see
-            # above for the rationale.
-            if not args.timing:
-                np.savez(filename, K=K, y=y)
-        
-        stop_time = time.process_time()
-
-        # We overwrite this *all* the time because the information can
-        # always be replaced easily.
-        with open(os.path.join(args.output, f'Time_{algorithm}.txt'), 'w') as f:
-            print(stop_time - start_time, file=f)
+    # The kernels are independent of each other, so we can calculate
+    # them concurrently. Each worker measures its own process time. The
+    # progress is reported by `joblib` whenever a kernel is finished.
+    #
+    # In timing mode, kernels are calculated one after the other since
+    # concurrent kernels compete for cores and memory bandwidth, which
+    # would inflate their run times. Negative numbers of jobs are
+    # interpreted as in `joblib`, i.e. -1 uses all processors.
+    if args.timing:
+        n_jobs = 1
+    else:
+        n_jobs = min(len(jobs), effective_n_jobs(args.n_jobs or -1))
+
+    Parallel(n_jobs=max(n_jobs, 1), verbose=10)(
+        delayed(compute_matrices)(
+            algorithm,
+            algorithms[algorithm],
+            param_grid.get(algorithm),
+            graphs,
+            y,
+            filename,
+            args.timing,
+            sweep=algorithm in sweeps
+        ) for algorithm, filename in jobs
+    )
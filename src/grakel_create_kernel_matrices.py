@@ -9,7 +9,6 @@
 import argparse
 import logging
 import os
-import random
 import sys
 import traceback
 
@@ -17,13 +16,17 @@ import grakel
 from grakel import GraphletSampling
 from grakel.kernels import ShortestPath, WeisfeilerLehman, VertexHistogram
 from grakel.kernels import EdgeHistogram, RandomWalkLabeled, GraphHopper
-import igraph as ig
 import numpy as np
 
+from joblib import Parallel, delayed, effective_n_jobs
 from timeit import time
 from tqdm import tqdm
 
+from cache_util import cache_filename, file_key, load_or_create
+from graph_io import list_graph_files
+from graph_io import read_sample
 from grakel_util import *
+from kernel_util import gram, save_matrices
 
 
 def preprocess(graph):
@@ -35,26 +38,32 @@ def preprocess(graph):
     return(graph)
 
 
-def relabel_edges(graph, edge_labels):
-    ''' Relabels edges using the concatenated node labels hashed to an
-    integer'''
-    for e in graph.es:
-            
-        a = graph.vs['label'][e.source]
-        b = graph.vs['label'][e.target] 
-        k = str(min(a,b)) + "." + str(max(a,b))
-        e['label'] = edge_labels[k]
-
-        # uniform label
-        e['label'] = 1
+def relabel_edges(graph):
+    ''' Assigns a uniform label to all edges of the graph '''
+    graph.es['label'] = 1
 
     return(graph)
 
 
+def load_graphs(filenames, n_graphs, same_size=False, timing=False):
+    """ Loads and pre-processes the graphs of a data set, using a random
+    subset of at most `n_graphs` graphs, or of at most 100 graphs for
+    measuring run times. """
+    graphs = read_sample(filenames, n_graphs, same_size, timing)
+
+    graphs = [preprocess(graph) for graph in tqdm(graphs, desc="Preprocessing")]
+    
+    # check if the graph has edge labels, and if not, relabel edges
+    if 'label' not in graphs[0].es.attributes():
+        graphs = [relabel_edges(graph) for graph in graphs]
+
+    return(graphs)
+
+
 def gk_function(algorithm, graphs, par):
     """ Function to run the kernel on the param grid. Since different
     kernels have different numbers of parameters, this is necessary. """
-    print("parameters", par)
+    logging.debug(f"Parameters: {par}")
     if algorithm == "SP_gkl":
         gk = ShortestPath(with_labels=True).fit_transform(graphs)
     elif algorithm == "EH_gkl":
@@ -80,6 +89,83 @@ def gk_function(algorithm, graphs, par):
     return(gk)
 
 
+def wl_sweep(graphs, params):
+    """ Calculates the WL kernel for all numbers of iterations in the
+    param grid from a single fit. The fitted kernel keeps one vertex
+    histogram kernel per iteration, and the WL kernel for `n_iter=h` is
+    the sum of the Gram matrices of the first of them. """
+    n_iter = max(params)
+    wl = WeisfeilerLehman(
+            n_iter=n_iter,
+            base_graph_kernel=VertexHistogram,
+            normalize=False
+            )
+    wl.fit(graphs)
+
+    # Depending on the grakel version, the initial labelling may be
+    # counted as an iteration or not, hence the offset.
+    offset = len(wl.X) - n_iter
+    K = np.cumsum([gram(wl.X[i].X) for i in range(len(wl.X))], axis=0)
+
+    return([K[h + offset - 1] for h in params])
+
+
+def compute_matrices(algorithm, params, graphs, y, filename, timing):
+    """ Runs a single kernel on the param grid and stores the resulting
+    kernel matrices and timing information. This is self-contained so
+    that it can run in a worker process. """
+    start_time = time.process_time()
+
+    if params is not None:
+        try:
+            if algorithm == "WL_gkl":
+                matrices = dict(zip(map(str, params), wl_sweep(graphs, params)))
+            else:
+                matrices = {
+                        str(param): gk_function(
+                            algorithm=algorithm, 
+                            graphs=graphs, 
+                            par=param) 
+                        for param in params
+                        }
+            logging.debug([matrices[a].shape for a in matrices])
+        except NotImplementedError:
+            logging.warning(f'''Caught exception for {algorithm};
+            continuing with the next algorithm and its corresponding
+            parameter grid.''')
+
+            traceback.print_exc()
+            return
+
+        # Store the label vector of the graph data set along with
+        # the set of matrices.
+        matrices['y'] = y
+        
+        # We only save matrices if we are not in timing mode. In
+        # some sense, the calculations will thus be lost, but we
+        # should not account for the save time anyway.
+        if not timing:
+            save_matrices(filename, **matrices)
+
+    else:
+        K = gk_function(algorithm=algorithm, graphs=graphs, par=None)
+        logging.debug(K.shape)
+
+        # We only save the matrix if we are not in timing mode; see
+        # above for the rationale.
+        if not timing:
+            save_matrices(filename, K=K, y=y)
+
+    stop_time = time.process_time()
+
+    # We overwrite this *all* the time because the information can
+    # always be replaced easily.
+    output = os.path.dirname(filename)
+    time_filename = os.path.join(output, f'Time_{algorithm}.txt')
+    with open(time_filename, 'w') as time_file:
+        print(stop_time - start_time, file=time_file)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -119,8 +205,26 @@ if __name__ == "__main__":
         action='store_const', const=True, default=False,
         help='todo'
     )
+    parser.add_argument(
+            '-j', '--n-jobs',
+            type=int,
+            default=None,
+            help='Number of algorithms to run in parallel; negative values are '
+                 'interpreted as in joblib (default: all; 1 in timing mode)'
+        )
+    parser.add_argument(
+            '--no-cache', action='store_true',
+            default=False,
+            help='If specified, does not use cached pre-processed graphs'
+        )
     args = parser.parse_args()
-    input_files = [f"{args.FILE}/{file}" for file in os.listdir(args.FILE) if file.endswith('.pickle')]
+
+    # The input is either a directory of graph files or a single file
+    # of flat arrays created by `convert_to_arrays.py`.
+    if os.path.isfile(args.FILE):
+        input_files = [args.FILE]
+    else:
+        input_files = list_graph_files(args.FILE)
 
     logging.basicConfig(level=logging.INFO, format=None)
 
@@ -129,9 +233,6 @@ if __name__ == "__main__":
     if args.timing:
         logging.info("Choosing at most 100 graphs at random for timing")
 
-        random.seed(42)
-        input_files = random.sample(input_files, 100)
-
     graph_attributes = {
         "SP_gkl": {"vertex": "label", "edge": []},
         "EH_gkl": {"vertex": [], "edge": "label"},
@@ -142,13 +243,16 @@ if __name__ == "__main__":
         'GL_gkl': {'vertex': [], 'edge': []},
     }
 
-    graphs = [ig.read(filename, format='picklez') for filename in tqdm(input_files, desc='File')]
-
-    if args.same_size:
-        values, counts = np.unique([len(G.vs) for G in graphs], return_counts=True)
-        n_nodes = values[np.argmax(counts)]
-        graphs = [G for G in graphs if len(G.vs) == n_nodes]
-        print(f"Use only graphs of size {n_nodes}")
+    # Files created by `convert_to_arrays.py` only contain labels, so
+    # algorithms that require attributes need the graph files.
+    if os.path.isfile(args.FILE):
+        for algorithm in sorted(set(args.algorithm)):
+            attr = graph_attributes.get(algorithm, {})
+            if any(a in ['both', 'attribute'] for a in attr.values()):
+                raise ValueError(
+                    f"{algorithm} requires attributes, which are not stored "
+                    f"in {args.FILE}; use the directory of graph files instead."
+                )
 
     # Sample graphs
     dataset = args.output.split('/')[-1]
@@ -163,19 +267,21 @@ if __name__ == "__main__":
         'FRANKENSTEIN': 500,
         'DHFR': 500,
     }
-    if n_graphs[dataset] < len(graphs):
-        rng = np.random.default_rng(403371)
-        graphs = rng.choice(graphs, n_graphs[dataset], replace=False)
 
-    graphs = [preprocess(graph) for graph in tqdm(graphs, desc="Preprocessing")]
-    
-    # check if the graph has edge labels, and if not, relabel edges
-    if 'label' not in graphs[0].es.attributes():
-        edge_labels = set_of_edge_labels(graphs)
-        graphs = [relabel_edges(graph, edge_labels) for graph in graphs]
-    
-    # convert to grakel format
-    graphs, y = igraph_to_grakel(graphs, attr=graph_attributes[args.algorithm[0]])
+    # Loading and pre-processing only depends on the input files and
+    # on the sampling settings, so the result can be cached.
+    graphs_key = (
+        file_key(input_files), args.same_size, n_graphs[dataset], args.timing
+    )
+    graphs = load_or_create(
+        cache_filename(
+            args.output, 'grakel_create_kernel_matrices', *graphs_key
+        ),
+        lambda: load_graphs(
+            input_files, n_graphs[dataset], args.same_size, args.timing
+        ),
+        use_cache=not args.no_cache
+    )
 
     param_grid = {
         "SP_gkl": [1],
@@ -196,17 +302,17 @@ if __name__ == "__main__":
         "GL_gkl": "Not used",
     }
 
-    # Remove algorithms that have not been specified by the user; this
-    # makes it possible to run only a subset of all configurations.
-    algorithms = {
-        k: v for k, v in algorithms.items() if k in args.algorithm
-    }
-
     os.makedirs(args.output, exist_ok=True)
 
-    for algorithm in sorted(tqdm(algorithms.keys(), desc='Algorithm')):
-        
-        start_time = time.process_time()
+    # Check which algorithms would overwrite an existing output before
+    # dispatching any of them.
+    #
+    # Only algorithms that have been specified by the user are used; this
+    # makes it possible to run only a subset of all configurations.
+    jobs = []
+    for algorithm in sorted(set(args.algorithm)):
+        if algorithm not in algorithms:
+            continue
 
         # Filename for the current algorithm. We create this beforehand
         # in order to check whether we would overwrite something.
@@ -217,49 +323,46 @@ if __name__ == "__main__":
                 logging.info('Output path already exists. Skipping.')
                 continue
 
-        # Function to apply to the list of graphs in order to obtain
-        # a kernel matrix.
-        #f = algorithm[algorithm]
-
-        if algorithm in param_grid.keys():
-            try:
-                matrices = {
-                        str(param): gk_function(
-                            algorithm=algorithm, 
-                            graphs=graphs, 
-                            par=param) 
-                        for param in param_grid[algorithm]
-                        }
-                print([matrices[a].shape for a in matrices])
-            except NotImplementedError:
-                logging.warning(f'''Caught exception for {algorithm};
-                continuing with the next algorithm and its corresponding
-                parameter grid.''')
-
-                traceback.print_exc()
-                continue
-
-            # Store the label vector of the graph data set along with
-            # the set of matrices.
-            matrices['y'] = y
-            
-            # We only save matrices if we are not in timing mode. In
-            # some sense, the calculations will thus be lost, but we
-            # should not account for the save time anyway.
-            if not args.timing:
-                np.savez(filename, **matrices)
-
-        else:
-            K = gk_function(algorithm=algorithm, graphs=graphs, par=None)
-            print(K.shape) 
-            # We only save the matrix if we are not in timing mode; see
-            # above for the rationale.
-            if not args.timing:
-                np.savez(filename, K=K, y=y)
-
-        stop_time = time.process_time()
-
-        # We overwrite this *all* the time because the information can
-        # always be replaced easily.
-        with open(os.path.join(args.output, f'Time_{algorithm}.txt'), 'w') as f:
-            print(stop_time - start_time, file=f)
+        jobs.append((algorithm, filename))
+
+    # Convert to grakel format once for every attribute specification
+    # that is required; several algorithms share the same one.
+    grakel_graphs = {}
+    conversions = {}
+    for algorithm, _ in jobs:
+        attr = graph_attributes[algorithm]
+        attr_key = repr(sorted(attr.items()))
+
+        if attr_key not in conversions:
+            conversions[attr_key] = load_or_create(
+                cache_filename(
+                    args.output, 'igraph_to_grakel', *graphs_key, attr_key
+                ),
+                lambda: igraph_to_grakel(graphs, attr=attr),
+                use_cache=not args.no_cache
+            )
+
+        grakel_graphs[algorithm] = conversions[attr_key]
+
+    # The kernels are independent of each other, so we can calculate
+    # them concurrently. Each worker measures its own process time. The
+    # progress is reported by `joblib` whenever a kernel is finished.
+    #
+    # In timing mode, kernels are calculated one after the other since
+    # concurrent kernels compete for cores and memory bandwidth, which
+    # would inflate their run times. Negative numbers of jobs are
+    # interpreted as in `joblib`, i.e. -1 uses all processors.
+    if args.timing:
+        n_jobs = 1
+    else:
+        n_jobs = min(len(jobs), effective_n_jobs(args.n_jobs or -1))
+
+    Parallel(n_jobs=max(n_jobs, 1), verbose=10)(
+        delayed(compute_matrices)(
+            algorithm,
+            param_grid.get(algorithm),
+            *grakel_graphs[algorithm],
+            filename,
+            args.timing
+        ) for algorithm, filename in jobs
+    )
@@ -204,7 +204,7 @@ def igraph_to_grakel(graphs, attr):
         if len(g[0]) > 0:
             grakel_graphs.append(g)
             y.append(graph['label'])
-    return(grakel_graphs, y)
+    return(grakel_graphs, np.array(y, dtype=np.int32))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+#
+# graph_io.py: functions for reading the graphs of a data set, which
+# are stored in one `picklez` file per graph or, alternatively, as flat
+# arrays in a single `.npz` file created by `convert_to_arrays.py`.
+
+import os
+import random
+
+from concurrent.futures import ThreadPoolExecutor
+
+import igraph as ig
+import numpy as np
+
+from tqdm import tqdm
+
+# Maximum number of graphs that are used for measuring run times
+N_TIMING_GRAPHS = 100
+
+
+def list_graph_files(directory):
+    '''
+    Lists the graph files in a directory. Graphs are sampled by their
+    position, so every script has to use this order for a directory.
+
+    :param directory: Directory with one `.pickle` file per graph
+    :return: List of graph files, in `os.listdir` order
+    '''
+
+    return [
+        f"{directory}/{file}" for file in os.listdir(directory)
+        if file.endswith('.pickle')
+    ]
+
+
+def read_graphs(filenames):
+    '''
+    Reads a list of graphs. Files are read concurrently because most of
+    the time is spent on decompressing them.
+
+    :param filenames: Input files, one per graph
+    :return: List of graphs, in the order of the input files
+    '''
+
+    with ThreadPoolExecutor() as executor:
+        return list(tqdm(
+            executor.map(lambda f: ig.read(f, format='picklez'), filenames),
+            total=len(filenames),
+            desc='File'
+        ))
+
+
+def graphs_to_arrays(graphs):
+    '''
+    Converts a list of graphs into flat arrays that describe all graphs
+    at once. Vertices and edges of graph `i` are stored at the positions
+    given by `vertex_offsets[i]:vertex_offsets[i + 1]` and by
+    `edge_offsets[i]:edge_offsets[i + 1]`, respectively; edges refer to
+    the vertices of their own graph. Only the graph label and the vertex
+    and edge labels are stored, but no other attributes. Vertex or edge
+    labels are only stored if *all* graphs have them.
+
+    :param graphs: List of graphs with a `label` graph attribute
+    :return: Dictionary of arrays, indexed by their name
+    '''
+
+    n_vertices = [graph.vcount() for graph in graphs]
+    n_edges = [graph.ecount() for graph in graphs]
+
+    edges = np.concatenate([
+        np.array(graph.get_edgelist(), dtype=np.int32).reshape(-1, 2)
+        for graph in graphs
+    ])
+
+    arrays = {
+        'vertex_offsets': np.concatenate(([0], np.cumsum(n_vertices))),
+        'edge_offsets': np.concatenate(([0], np.cumsum(n_edges))),
+        'edge_sources': edges[:, 0],
+        'edge_targets': edges[:, 1],
+        'y': np.array([graph['label'] for graph in graphs]),
+    }
+
+    if all('label' in graph.vs.attributes() for graph in graphs):
+        arrays['vertex_labels'] = np.concatenate(
+            [graph.vs['label'] for graph in graphs]
+        )
+
+    if all('label' in graph.es.attributes() for graph in graphs):
+        arrays['edge_labels'] = np.concatenate(
+            [graph.es['label'] for graph in graphs]
+        )
+
+    return arrays
+
+
+def arrays_to_graphs(arrays, indices):
+    '''
+    Creates graphs from the flat arrays of a data set.
+
+    :param arrays: Dictionary of arrays, as created by `graphs_to_arrays()`
+    :param indices: Indices of the graphs to create
+    :return: List of graphs
+    '''
+
+    vertex_offsets = arrays['vertex_offsets']
+    edge_offsets = arrays['edge_offsets']
+
+    graphs = []
+
+    for i in indices:
+        v0, v1 = vertex_offsets[i], vertex_offsets[i + 1]
+        e0, e1 = edge_offsets[i], edge_offsets[i + 1]
+
+        G = ig.Graph(
+            n=int(v1 - v0),
+            edges=list(zip(
+                arrays['edge_sources'][e0:e1].tolist(),
+                arrays['edge_targets'][e0:e1].tolist()
+            ))
+        )
+        G['label'] = arrays['y'][i]
+
+        if 'vertex_labels' in arrays:
+            G.vs['label'] = arrays['vertex_labels'][v0:v1].tolist()
+
+        if 'edge_labels' in arrays:
+            G.es['label'] = arrays['edge_labels'][e0:e1].tolist()
+
+        graphs.append(G)
+
+    return graphs
+
+
+def load_arrays(filename):
+    '''
+    Loads the flat arrays of a data set.
+
+    :param filename: Input file, as created by `convert_to_arrays.py`
+    :return: Dictionary of arrays, indexed by their name
+    '''
+
+    with np.load(filename) as data:
+        return {key: data[key] for key in data}
+
+
+def sample_indices(indices, n_graphs, sizes=None):
+    '''
+    Chooses a random subset of the graphs of a data set.
+
+    :param indices: Indices of the graphs to choose from
+    :param n_graphs: Maximum number of graphs to use
+    :param sizes: If set, only uses graphs of the most common size; the
+    sizes have to be given in the same order as the indices
+    :return: Indices of the chosen graphs
+    '''
+
+    if sizes is not None:
+        values, counts = np.unique(sizes, return_counts=True)
+        n_nodes = values[np.argmax(counts)]
+        indices = indices[sizes == n_nodes]
+        print(f"Use only graphs of size {n_nodes}")
+
+    # Sampling only depends on the number of graphs, so choosing from
+    # the indices selects the same graphs as choosing from the graphs.
+    if n_graphs < len(indices):
+        rng = np.random.default_rng(403371)
+        indices = rng.choice(indices, n_graphs, replace=False)
+
+    return indices
+
+
+def read_sample(filenames, n_graphs, same_size=False, timing=False):
+    '''
+    Reads a random subset of the graphs of a data set. The subset is
+    chosen before reading any files whenever possible, so files that
+    would be discarded anyway are not read at all. Instead of one file
+    per graph, a single `.npz` file containing the flat arrays of the
+    data set may be given; only the chosen graphs are created then.
+
+    :param filenames: Input files, one per graph, or a single `.npz` file
+    :param n_graphs: Maximum number of graphs to use
+    :param same_size: If set, only uses graphs of the most common size
+    :param timing: If set, all other choices are restricted to a random
+    subset of at most `N_TIMING_GRAPHS` graphs, which is used for
+    measuring run times
+    :return: List of graphs
+    '''
+
+    arrays = None
+
+    if len(filenames) == 1 and filenames[0].endswith('.npz'):
+        arrays = load_arrays(filenames[0])
+        n = len(arrays['vertex_offsets']) - 1
+    else:
+        n = len(filenames)
+
+    indices = np.arange(n)
+
+    # This selects the same graphs as sampling from the list of input
+    # files directly because the choice only depends on its length.
+    if timing:
+        indices = np.array(
+            random.Random(42).sample(range(n), min(n, N_TIMING_GRAPHS)),
+            dtype=int
+        )
+
+    if arrays is not None:
+        sizes = np.diff(arrays['vertex_offsets'])[indices]
+        indices = sample_indices(
+            indices, n_graphs, sizes if same_size else None
+        )
+        return arrays_to_graphs(arrays, indices)
+
+    # The size of a graph is only known after reading it, so we have
+    # to read all remaining graphs in this case.
+    if same_size:
+        graphs = read_graphs([filenames[i] for i in indices])
+        sizes = np.array([len(G.vs) for G in graphs])
+        positions = sample_indices(np.arange(len(graphs)), n_graphs, sizes)
+        return [graphs[i] for i in positions]
+
+    indices = sample_indices(indices, n_graphs)
+    return read_graphs([filenames[i] for i in indices])
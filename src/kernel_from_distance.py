@@ -1,28 +1,69 @@
 #!/usr/bin/env python3
 
 import argparse
+import math
 import os
 
 import numpy as np
-from sklearn.model_selection import ParameterGrid
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor
+from numba import njit, prange
 
 
 def check_distance_matrix(distances, log=False):
     # Check distance matrix, TODO remove after integration in main repo
-    n_errors = np.count_nonzero(np.isnan(distances) | np.isinf(distances))
-    if n_errors > 0:
+    finite = np.isfinite(distances)
+    if not finite.all():
+        n_errors = finite.size - np.count_nonzero(finite)
         if log: print(f'Warning: {n_errors} NaNs/infs in distance matrix.')
-        if (np.isnan(distances) | np.isinf(distances)).all():
+        if not finite.any():
             return np.ones_like(distances)
-    distances = np.nan_to_num(distances, nan=np.nanmax(distances))
+
+        # As in `np.nan_to_num`, NaNs are replaced by the largest distance,
+        # which may be infinite, and negative infinities by the smallest
+        # representable value. Positive infinities are kept because the
+        # RBF kernel maps them to zero.
+        nan = np.isnan(distances)
+        np.copyto(distances, distances[~nan].max(), where=nan)
+        np.copyto(
+            distances,
+            np.finfo(distances.dtype).min,
+            where=np.isneginf(distances)
+        )
 
     # Ensure that the distance matrix is non-negative
-    if np.min(distances) < 0:
+    min_distance = distances.min()
+    if min_distance < 0:
         if log: print(f'Warning: negative values in distance matrix.')
-        distances -= np.min(distances)
+        distances -= min_distance
     return distances
 
 
+# Fast-math flags without `nnan` and `ninf`: large values of gamma make
+# the exponent overflow to infinity, which has to result in zero.
+@njit(
+    parallel=True,
+    fastmath={'afn', 'arcp', 'contract', 'nsz', 'reassoc'},
+    cache=True
+)
+def rbf(distances, gamma, out):
+    '''
+    Evaluates the RBF kernel for a matrix of distances. The rows of the
+    matrix are processed in parallel.
+
+    :param distances: Distance matrix
+    :param gamma: Kernel coefficient; should have the same precision as
+    the distance matrix
+    :param out: Output array of the same shape as the distance matrix
+    '''
+
+    n, m = distances.shape
+    for i in prange(n):
+        for j in range(m):
+            out[i, j] = math.exp(-gamma * distances[i, j])
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('DATA', type=str, help='Input file')
@@ -64,25 +105,73 @@ if __name__ == '__main__':
         'epsilon': np.array([0.002, 0.004, 0.006, 0.008, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1]),
         # 'epsilon': np.array([0.002, 0.004, 0.006, 0.008, 0.01, 0.06, 0.08, 0.1]),
     }
-    grid = ParameterGrid(param_grid)
 
-    matrices = dict()
+    if args.kernel != 'rbf':
+        raise ValueError(f"The given kernel ´{args.kernel}´ is not supported.")
+
+    gammas = param_grid['gamma']
+
+    # Matrices are saved in the background while the next algorithm is
+    # being processed. Every algorithm uses a new stack of matrices, so
+    # they can be handed over to the thread without copying them.
+    io_pool = ThreadPoolExecutor(max_workers=1)
+    future = None
+
     for algo in args.algorithm:
         y = np.loadtxt(f"{args.DATA}/labels.csv")
 
-        if args.kernel == 'rbf':
-            def f(gamma, epsilon):
-                distances = np.loadtxt(f"{args.DATA}/{algo}-{epsilon}-approx.csv")
-                distances = check_distance_matrix(distances, log=False)
-                return np.exp(-gamma * distances)
-        else:
-            raise ValueError(f"The given kernel ´{args.kernel}´ is not supported.")
+        # Parameters follow the order of `ParameterGrid`, i.e. they are
+        # of the form `epsilon#gamma`, with gamma varying fastest.
+        params = [
+            '#'.join(map(str, (epsilon, gamma)))
+            for epsilon in param_grid['epsilon'] for gamma in gammas
+        ]
 
-        matrices = {
-            '#'.join(map(str, param.values())): f(gamma=param['gamma'], epsilon=param['epsilon'])
-            for param in grid
-        }
-        matrices['y'] = y
+        # All kernel matrices are stored in a single stack, which is
+        # allocated once the size of the distance matrices is known.
+        K = None
 
+        for index, epsilon in enumerate(param_grid['epsilon']):
+            # Single precision is sufficient for the downstream SVM and
+            # halves the memory traffic of the conversion below. We use
+            # the C parser of `pandas` because `np.loadtxt` is slow for
+            # large matrices.
+            distances = pd.read_csv(
+                f"{args.DATA}/{algo}-{epsilon}-approx.csv",
+                sep=r'\s+',
+                header=None,
+                dtype=np.float32
+            ).to_numpy()
+            distances = check_distance_matrix(distances, log=False)
+
+            if K is None:
+                K = np.empty((len(params),) + distances.shape, dtype=distances.dtype)
+
+            offset = index * len(gammas)
+
+            for i, gamma in enumerate(gammas):
+                rbf(distances, distances.dtype.type(gamma), K[offset + i])
+
+        # Instead of one entry per kernel matrix, the file contains the
+        # stack of matrices `K` and their parameters `params`. This is
+        # faster to write and to read for large parameter grids.
         os.makedirs(f"{args.output}", exist_ok=True)
-        np.savez(f"{args.output}/{algo}.npz", **matrices)
+
+        # Wait for the previous file to be written, so that at most two
+        # stacks of matrices are kept in memory. This also raises any
+        # exception that occurred while saving.
+        if future is not None:
+            future.result()
+
+        future = io_pool.submit(
+            np.savez,
+            f"{args.output}/{algo}.npz",
+            K=K,
+            params=np.array(params),
+            y=y
+        )
+
+    if future is not None:
+        future.result()
+
+    io_pool.shutdown()
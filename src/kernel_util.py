@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+#
+# kernel_util.py: graph kernels that are based on an explicit feature
+# map. They are calculated directly with `numpy` and `scipy` instead of
+# the `graphkernels` package so that intermediate results, such as the
+# label refinements of the Weisfeiler--Lehman kernel, can be re-used.
+
+import numpy as np
+
+from scipy.sparse import csr_matrix
+from scipy.sparse import issparse
+from scipy.linalg.blas import ssyrk
+
+
+def flatten_graphs(graphs):
+    '''
+    Converts a list of graphs into flat arrays that describe all graphs
+    at once. Vertices are numbered consecutively over all graphs, and
+    vertex labels are compressed to consecutive integers. As in the
+    `graphkernels` package, labels are truncated to integers first.
+
+    :param graphs: List of graphs with a `label` vertex attribute
+    :return: Tuple of vertex labels, edge sources, edge targets, and the
+    index of the graph each vertex belongs to
+    '''
+
+    sizes = np.array([graph.vcount() for graph in graphs], dtype=int)
+    offsets = np.cumsum(sizes) - sizes
+
+    _, labels = np.unique(
+        np.concatenate([graph.vs['label'] for graph in graphs]).astype(int),
+        return_inverse=True
+    )
+
+    edges = np.concatenate([
+        np.array(graph.get_edgelist(), dtype=int).reshape(-1, 2) + offset
+        for graph, offset in zip(graphs, offsets)
+    ])
+
+    graph_index = np.repeat(np.arange(len(graphs)), sizes)
+
+    return labels.ravel(), edges[:, 0], edges[:, 1], graph_index
+
+
+def label_histograms(labels, graph_index, n_graphs):
+    '''
+    Counts the labels of each graph.
+
+    :param labels: Vertex labels, compressed to consecutive integers
+    :param graph_index: Index of the graph each vertex belongs to
+    :param n_graphs: Number of graphs
+    :return: Sparse matrix whose rows are the label histograms
+    '''
+
+    return csr_matrix(
+        (np.ones(len(labels)), (graph_index, labels)),
+        shape=(n_graphs, labels.max(initial=-1) + 1)
+    )
+
+
+def gram(X):
+    '''
+    Calculates the Gram matrix of a feature matrix, i.e. the matrix of
+    all pairwise inner products of its rows. For dense feature matrices,
+    this uses a symmetric rank-k update in single precision, which only
+    calculates one triangle of the result.
+
+    :param X: Dense or sparse feature matrix
+    :return: Dense Gram matrix
+    '''
+
+    if issparse(X):
+        return (X @ X.T).toarray()
+
+    # The transposed matrix is Fortran-contiguous, so BLAS can use it
+    # without a copy. With `trans=1`, the update calculates X @ X.T and
+    # stores it in the upper triangle of the result.
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    K = ssyrk(1.0, X.T, trans=1)
+
+    return np.triu(K) + np.triu(K, 1).T
+
+
+def vertex_histogram_kernel(graphs):
+    '''
+    Calculates the vertex histogram kernel, i.e. the linear kernel on
+    the counts of vertex labels.
+
+    :param graphs: List of graphs with a `label` vertex attribute
+    :return: Kernel matrix
+    '''
+
+    labels, _, _, graph_index = flatten_graphs(graphs)
+    return gram(label_histograms(labels, graph_index, len(graphs)))
+
+
+def edge_histogram_kernel(graphs):
+    '''
+    Calculates the edge histogram kernel, i.e. the linear kernel on the
+    counts of edge labels. As in the `graphkernels` package, all edges
+    of a graph without edge labels are assigned the same label.
+
+    :param graphs: List of graphs
+    :return: Kernel matrix
+    '''
+
+    sizes = np.array([graph.ecount() for graph in graphs], dtype=int)
+
+    _, labels = np.unique(
+        np.concatenate([
+            graph.es['label'] if 'label' in graph.es.attributes()
+            else np.ones(graph.ecount())
+            for graph in graphs
+        ]).astype(int),
+        return_inverse=True
+    )
+
+    graph_index = np.repeat(np.arange(len(graphs)), sizes)
+
+    return gram(label_histograms(labels.ravel(), graph_index, len(graphs)))
+
+
+def weisfeiler_lehman_refine(labels, sources, targets):
+    '''
+    Performs one iteration of the Weisfeiler--Lehman relabelling scheme.
+    The new label of a vertex is given by its current label and by the
+    sorted multiset of the labels of its neighbours.
+
+    :param labels: Vertex labels, compressed to consecutive integers
+    :param sources: Source vertices of all edges
+    :param targets: Target vertices of all edges
+    :return: New vertex labels, compressed to consecutive integers
+    '''
+
+    n_vertices = len(labels)
+
+    # The sequence of a vertex consists of its own label, followed by
+    # the labels of its neighbours; every undirected edge contributes a
+    # neighbour to both of its vertices. Sorting by vertex, then by the
+    # kind of entry, and then by label results in the sequences of all
+    # vertices, one after the other.
+    heads = np.concatenate((np.arange(n_vertices), sources, targets))
+    values = np.concatenate((labels, labels[targets], labels[sources]))
+    kinds = np.repeat([0, 1], [n_vertices, 2 * len(sources)])
+
+    order = np.lexsort((values, kinds, heads))
+    values = values[order].astype(np.int64)
+
+    sequence_lengths = np.bincount(heads, minlength=n_vertices)
+    lengths = sequence_lengths
+
+    # Compress the sequences by replacing pairs of consecutive entries
+    # with a new value until one value per vertex remains. Sequences of
+    # odd length are padded with a value that cannot occur otherwise.
+    # Since equal pairs are always replaced by equal values, and since
+    # sequences of the same length are paired up in the same way, two
+    # sequences of the same length end up with the same value if and
+    # only if they are equal. This requires O(E) memory, as opposed to
+    # padding all sequences to the largest degree.
+    while lengths.max(initial=0) > 1:
+        starts = np.cumsum(lengths) - lengths
+        positions = np.arange(len(values)) - np.repeat(starts, lengths)
+
+        pair_lengths = (lengths + 1) // 2
+        pair_starts = np.cumsum(pair_lengths) - pair_lengths
+        pair_index = np.repeat(pair_starts, lengths) + positions // 2
+
+        pairs = np.full((pair_lengths.sum(), 2), -1, dtype=np.int64)
+        pairs[pair_index, positions % 2] = values
+
+        # Encoding a pair as a single integer is much faster than
+        # finding unique rows.
+        base = values.max() + 2
+        _, values = np.unique(
+            pairs[:, 0] * base + pairs[:, 1] + 1, return_inverse=True
+        )
+        values = values.ravel()
+        lengths = pair_lengths
+
+    # Sequences of different lengths may have been compressed to the
+    # same value, so the length is part of the new label.
+    _, labels = np.unique(
+        sequence_lengths * (values.max(initial=0) + 1) + values,
+        return_inverse=True
+    )
+    return labels.ravel()
+
+
+def weisfeiler_lehman_sweep(graphs, iterations):
+    '''
+    Calculates the Weisfeiler--Lehman subtree kernel for several numbers
+    of iterations at once. The kernel for $h$ iterations is the sum of
+    the vertex histogram kernels of the first $h$ relabelling steps, so
+    the refinement only has to be performed once, for the largest $h$.
+
+    :param graphs: List of graphs with a `label` vertex attribute
+    :param iterations: Numbers of iterations $h$ to calculate
+    :return: List of kernel matrices, one for each entry of `iterations`
+    '''
+
+    labels, sources, targets, graph_index = flatten_graphs(graphs)
+
+    n_graphs = len(graphs)
+    K = np.zeros((n_graphs, n_graphs))
+    kernels = {}
+
+    for h in range(max(iterations) + 1):
+        if h > 0:
+            labels = weisfeiler_lehman_refine(labels, sources, targets)
+
+        X = label_histograms(labels, graph_index, n_graphs)
+        K = K + gram(X)
+        kernels[h] = K
+
+    return [kernels[h] for h in iterations]
+
+
+def save_matrices(filename, **matrices):
+    '''
+    Stores a set of kernel matrices in compressed form. Floating-point
+    arrays, i.e. the kernel matrices, are stored in single precision,
+    which is sufficient for training a classifier; all other arrays,
+    such as the labels, are stored unchanged.
+
+    :param filename: Output filename
+    :param matrices: Arrays to store, indexed by their name
+    '''
+
+    matrices = {
+        name: np.asarray(M, dtype=np.float32)
+        if np.issubdtype(np.asarray(M).dtype, np.floating) else M
+        for name, M in matrices.items()
+    }
+
+    np.savez_compressed(filename, **matrices)
@@ -10,10 +10,15 @@ import logging
 import json
 import os
 import sys
+import tempfile
 import warnings
 
 import numpy as np
 
+from joblib import Parallel
+from joblib import delayed
+from joblib import effective_n_jobs
+
 from sklearn.base import clone
 from sklearn.exceptions import UndefinedMetricWarning, ConvergenceWarning
 from sklearn.metrics import accuracy_score
@@ -21,10 +26,8 @@ from sklearn.metrics import average_precision_score
 from sklearn.metrics import precision_score
 from sklearn.metrics import recall_score
 from sklearn.metrics import roc_auc_score
-from sklearn.metrics import make_scorer
 from sklearn.model_selection import ParameterGrid
 from sklearn.model_selection import StratifiedKFold
-from sklearn.model_selection._validation import _fit_and_score
 from sklearn.preprocessing import label_binarize
 from sklearn.svm import SVC
 
@@ -35,26 +38,138 @@ from timeit import default_timer as timer
 from tqdm import tqdm
 
 
-def normalize(matrix):
+def normalization_factors(matrix):
+    '''
+    Calculates the factors by which the rows and columns of a kernel
+    matrix are scaled during normalization, i.e. the inverse square
+    roots of its diagonal entries.
+
+    :param matrix: Kernel matrix
+    :return: Vector of normalization factors
+    '''
+
+    # Ensures that only non-zero entries will be subjected to the
+    # normalisation procedure. The remaining entries will be kept
+    # at zero. This prevents 'NaN' values from cropping up.
+    epsilon = 1e-20  # Use small epsilon instead of 0 to prevent overflow
+    diagonal = np.diagonal(matrix)
+    mask = diagonal > epsilon
+    k = np.zeros(len(diagonal), dtype=diagonal.dtype)
+    k[mask] = 1.0 / np.sqrt(diagonal[mask])
+
+    return k
+
+
+def normalize(matrix, out=None):
     '''
     Normalizes a kernel matrix by dividing through the square root
     product of the corresponding diagonal entries. This is *not* a
     linear operation, so it should be treated as a hyperparameter.
 
     :param matrix: Matrix to normalize
+    :param out: Optional array in which to store the result; it needs
+    to have the same shape as the input matrix, and it may also *be*
+    the input matrix.
     :return: Normalized matrix
     '''
 
-    # Ensures that only non-zero entries will be subjected to the
-    # normalisation procedure. The remaining entries will be kept
-    # at zero. This prevents 'NaN' values from cropping up.
-    epsilon = 1e-20  # Use small epsilon instead of 0 to prevent overflow
-    mask = np.diagonal(matrix) > epsilon
-    n = len(np.diagonal(matrix))
-    k = np.zeros((n, ))
-    k[mask] = 1.0 / np.sqrt(np.diagonal(matrix)[mask])
+    k = normalization_factors(matrix)
+
+    # Scale rows and columns separately instead of multiplying with the
+    # outer product of `k`, which would require another n x n matrix.
+    out = np.multiply(matrix, k[:, None], out=out)
+    out *= k[None, :]
+
+    return out
+
+
+def normalize_block(matrix, rows, columns):
+    '''
+    Extracts a block of a kernel matrix and normalizes it. This gives
+    the same result as extracting the block from the normalized matrix,
+    but only the block itself needs to be normalized.
+
+    :param matrix: Kernel matrix
+    :param rows: Indices of the rows of the block
+    :param columns: Indices of the columns of the block
+    :return: Normalized block
+    '''
+
+    k = normalization_factors(matrix)
+
+    out = np.multiply(matrix[np.ix_(rows, columns)], k[rows, None])
+    out *= k[None, columns]
+
+    return out
+
+
+def load_matrices(filename):
+    '''
+    Loads a set of kernel matrices from a file. The file either stores
+    each kernel matrix separately, or it stores a stack of kernel
+    matrices `K` along with the parameters `params` that were used to
+    create them. In both cases, the label vector is stored as `y`.
+
+    :param filename: Input file
+    :return: Dictionary of kernel matrices, indexed by their parameter,
+    and the label vector, indexed by `y`
+    '''
+
+    data = np.load(filename)
+
+    if 'params' in data:
+        matrices = dict(zip(map(str, data['params']), data['K']))
+        matrices['y'] = data['y']
+    else:
+        matrices = {key: data[key] for key in data}
+
+    # Single precision is sufficient for the kernel matrices and halves
+    # the memory required for them and for all their sub-matrices.
+    for key in matrices:
+        if key != 'y':
+            matrices[key] = np.ascontiguousarray(
+                matrices[key], dtype=np.float32
+            )
+
+    return matrices
+
+
+def _evaluate(clf, K_train, y_train, K_test, y_test, parameter_list):
+    '''
+    Fits a classifier on one fold and evaluates it, using several sets
+    of parameters in turn. This is the unit of work of the grid search,
+    which may be run in a separate process.
+
+    :param clf: Classifier to fit; will *not* be modified
+    :param K_train: Kernel matrix of the training part of the fold
+    :param y_train: Labels of the training part of the fold
+    :param K_test: Kernel matrix between the test part and the training
+    part of the fold
+    :param y_test: Labels of the test part of the fold
+    :param parameter_list: List of parameters of the classifier
+
+    :return: List of accuracies on the test part of the fold, one for
+    each set of parameters
+    '''
+
+    accuracies = []
+
+    # A single copy of the classifier suffices because fitting replaces
+    # everything that has been learned by a previous fit.
+    estimator = clone(clf)
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=ConvergenceWarning)
+
+        for parameters in parameter_list:
+            estimator.set_params(**parameters)
+            estimator.fit(K_train, y_train)
+
+            accuracies.append(
+                accuracy_score(y_test, estimator.predict(K_test))
+            )
 
-    return np.multiply(matrix, np.outer(k, k))
+    return accuracies
 
 
 def grid_search_cv(
@@ -63,6 +178,7 @@ def grid_search_cv(
     n_folds,
     param_grid,
     kernel_matrices,
+    n_jobs=1,
 ):
     '''
     Internal grid search routine for a set of kernel matrices. The
@@ -78,13 +194,18 @@ def grid_search_cv(
     :param kernel_matrices: Kernel matrices to check; each one of them
     is assumed to represent a different choice of parameter. They will
     *all* be checked iteratively by the routine.
+    :param n_jobs: Number of jobs for fitting the classifiers; all folds
+    of all parameters and all matrices are independent of each other.
 
     :return: Best classifier, i.e. the classifier with the best
     parameters. Needs to be refit prior to predicting labels on
     the test data set. Moreover, the best-performing matrix, in
     terms of the grid search, is returned. It has to be used in
     all subsequent prediction tasks. Additionally, the function
-    also returns a dictionary of the best parameters.
+    also returns a dictionary of the best parameters, which also
+    specifies whether the matrix has to be normalized, and the
+    (normalized) sub-matrix of the best matrix that corresponds to
+    the train indices.
     '''
 
     y = kernel_matrices['y'][train_indices]
@@ -93,102 +214,167 @@ def grid_search_cv(
     best_accuracy = 0.0
     best_parameters = {}
 
+    grid = list(param_grid)
+
+    # Remove the normalization because it does not pertain to the
+    # classifier. This only has to be done once for every entry of
+    # the grid.
+    clf_parameter_list = [
+        {
+            key: value for key, value in parameters.items()
+            if key not in ['normalize']
+        }
+        for parameters in grid
+    ]
+
     # iterate over parameters in most outer loop to avoid issues
     # with matrix normalization (when we loop over the matrices)
     # in the next loop, then parameters['normalize'] can only
     # be either True or False.
-    for parameters in list(param_grid):
-
-        for K_param, K in kernel_matrices.items():
+    #
+    # Skip labels; we could also remove them from the set of matrices
+    # but this would make the function inconsistent because it should
+    # *not* fiddle with the input data set if it can be avoided.
+    candidates = [
+        (parameters, clf_parameters, K_param)
+        for parameters, clf_parameters in zip(grid, clf_parameter_list)
+        for K_param in kernel_matrices.keys() if K_param != 'y'
+    ]
+
+    # The folds are the same for every candidate, so they are only
+    # created once. From this point on, `train_index` and `test_index`
+    # are supposed to be understood *relative* to the input training
+    # indices.
+    cv = StratifiedKFold(
+        n_splits=n_folds,
+        shuffle=True,
+        random_state=42  # TODO: make configurable
+    )
+    folds = list(cv.split(train_indices, y))
+
+    # Indices for extracting the training and test sub-matrices of each
+    # fold; they are the same for every kernel matrix.
+    fold_indices = [
+        (np.ix_(train_index, train_index), np.ix_(test_index, train_index))
+        for train_index, test_index in folds
+    ]
+
+    # The training sub-matrices only depend on the kernel matrix, but
+    # not on the other parameters, so every matrix is sliced and
+    # normalized only once. This ensures that we *cannot* access the
+    # test indices, even if we try :)
+    train_ix = np.ix_(train_indices, train_indices)
+    sub = {
+        K_param: K[train_ix]
+        for K_param, K in kernel_matrices.items() if K_param != 'y'
+    }
+    sub_norm = {K_param: normalize(K) for K_param, K in sub.items()}
+
+    # Probability estimates are only required for the best classifier,
+    # and calculating them requires an additional cross-validation for
+    # every fit, so they are disabled while evaluating the candidates.
+    # The predictions themselves do not depend on this setting.
+    #
+    # Moreover, the candidates only need to be *ranked*, so they are fit
+    # with a looser stopping criterion and a tenth of the iterations;
+    # the best classifier is fit with the original settings. This
+    # results in far fewer iterations of the solver at the price of
+    # occasionally ranking two candidates with similar accuracies
+    # differently.
+    max_iter = clf.get_params()['max_iter']
+    if max_iter > 0:
+        max_iter = max(1, max_iter // 10)
+
+    cv_clf = clone(clf).set_params(
+        probability=False,
+        cache_size=512,
+        tol=1e-2,
+        max_iter=max_iter
+    )
 
-            # Skip labels; we could also remove them from the set of
-            # matrices but this would make the function inconsistent
-            # because it should *not* fiddle with the input data set
-            # if it can be avoided.
-            if K_param == 'y':
-                continue
+    # The sub-matrices of a fold only depend on the kernel matrix and
+    # on the normalization, so all candidates that share them, i.e.
+    # that only differ in the parameters of the classifier, are put in
+    # the same group and evaluated by the same task.
+    groups = collections.defaultdict(list)
+    for index, (parameters, _, K_param) in enumerate(candidates):
+        groups[(parameters['normalize'], K_param)].append(index)
 
-            # This ensures that we *cannot* access the test indices,
-            # even if we try :)
-            K = K[train_indices, :][:, train_indices]
+    def tasks():
+        for (normalized, K_param), indices in groups.items():
 
             # normalize kernel matrix if parameters['normalize'] == True
-            if parameters['normalize']:
-                K = normalize(K)
-
-            # Remove the parameter because it does not pertain to
-            # the classifier below.
-            clf_parameters = {
-                key: value for key, value in parameters.items()
-                if key not in ['normalize']
-            }
-
-            # we have to create a new cv instance for each parameter
-            # tuple, because StratifiedKFold returns a generator
-            cv = StratifiedKFold(
-                n_splits=n_folds,
-                shuffle=True,
-                random_state=42  # TODO: make configurable
-            )
+            if normalized:
+                K = sub_norm[K_param]
+            else:
+                K = sub[K_param]
+
+            clf_parameters = [candidates[i][1] for i in indices]
+
+            # The classifier converts its input to double precision on
+            # every call, so this is done once per fold beforehand.
+            for (train_index, test_index), (fold_train_ix, fold_test_ix) \
+                    in zip(folds, fold_indices):
+                yield delayed(_evaluate)(
+                    cv_clf,
+                    np.asarray(K[fold_train_ix], dtype=np.float64),
+                    y[train_index],
+                    np.asarray(K[fold_test_ix], dtype=np.float64),
+                    y[test_index],
+                    clf_parameters
+                )
 
-            # initialize empty list to store fold accuracies of the
-            # current parameters in.
-            accuracy_list = []
-
-            # From this point on, `train_index` and `test_index` are supposed to
-            # be understood *relative* to the input training indices.
-            for train_index, test_index in cv.split(train_indices, y):
-
-                with warnings.catch_warnings():
-                    warnings.filterwarnings("ignore", category=ConvergenceWarning)
-                    result = _fit_and_score(
-                        clone(clf),
-                        K, y,
-                        scorer=make_scorer(accuracy_score),
-                        train=train_index,
-                        test=test_index,
-                        verbose=0,
-                        parameters=clf_parameters,
-                        fit_params=None,  # No additional parameters for `fit()`
-                        return_parameters=True,
-                    )
-                accuracy = result['test_scores']
-                params = result['parameters']
-                accuracy_list.append(accuracy)
-
-            # compute accuracy mean of current parameters to compare to
-            # previously best result.
-            accuracy_mean = np.mean(accuracy_list)
-
-            # Note that when storing the best parameters, we can re-use
-            # the original grid because we want to know about this
-            # normalization.
-            if accuracy_mean > best_accuracy:
-                best_clf = clone(clf).set_params(**params)
-                best_accuracy = accuracy_mean
-
-                # Make a copy of the dictionary to ensure that we are
-                # not updating it with parameters that cannot be used
-                # in the grid search (such as `K`).
-                best_parameters = dict(parameters)
-
-                # Update kernel matrix parameter to indicate which
-                # matrix was used to obtain these results. The key
-                # will also be returned later on.
-                best_parameters['K'] = K_param
-
-    # Retrieve the kernel matrix of the best performing
-    # model and normalize if `best_parameters['normalize']` 
-    # is True
+    # The results are in the order of the tasks, i.e. for every group,
+    # there is one list of accuracies per fold, containing the accuracy
+    # of every candidate of the group.
+    results = iter(Parallel(n_jobs=n_jobs)(tasks()))
+
+    accuracies = np.zeros((len(candidates), n_folds))
+    for indices in groups.values():
+        for fold_index in range(n_folds):
+            accuracies[indices, fold_index] = next(results)
+
+    for (parameters, clf_parameters, K_param), accuracy_list in \
+            zip(candidates, accuracies):
+
+        # compute accuracy mean of current parameters to compare to
+        # previously best result.
+        accuracy_mean = np.mean(accuracy_list)
+
+        # Note that when storing the best parameters, we can re-use
+        # the original grid because we want to know about this
+        # normalization.
+        if accuracy_mean > best_accuracy:
+            best_clf = clone(clf).set_params(**clf_parameters)
+            best_accuracy = accuracy_mean
+
+            # Make a copy of the dictionary to ensure that we are
+            # not updating it with parameters that cannot be used
+            # in the grid search (such as `K`).
+            best_parameters = dict(parameters)
+
+            # Update kernel matrix parameter to indicate which
+            # matrix was used to obtain these results. The key
+            # will also be returned later on.
+            best_parameters['K'] = K_param
+
+    # Retrieve the kernel matrix of the best performing model. It
+    # is *not* normalized here because only some of its entries are
+    # required later on. Its training sub-matrix is already available
+    # and can be re-used for fitting the best classifier.
     best_K = kernel_matrices[best_parameters['K']]
+
     if best_parameters['normalize']:
-        best_K = normalize(best_K)
+        best_K_train = sub_norm[best_parameters['K']]
+    else:
+        best_K_train = sub[best_parameters['K']]
 
-    return best_clf, best_K, best_parameters
+    return best_clf, best_K, best_parameters, best_K_train
 
 
 def train_and_test(
-    train_indices, test_indices, matrices, n_classes, max_iterations
+    train_indices, test_indices, matrices, y, classes, max_iterations,
+    n_jobs=1, y_test_binarized=None
 ):
     '''
     Trains the classifier on a set of kernel matrices (that are all
@@ -198,8 +384,13 @@ def train_and_test(
     :param train_indices: Indices to be used for training
     :param test_indices: Indices to be used for testing
     :param matrices: Kernel matrices belonging to some algorithm
+    :param y: Labels of all graphs
     :param classes: Class labels
     :param max_iterations: Maximum number of iterations for SVM
+    :param n_jobs: Number of jobs for the grid search
+    :param y_test_binarized: Optional binarized labels of the test data
+    set, with one column per class. Since they do not depend on the
+    kernel matrices, they can be shared between calls.
 
     :return: Dictionary containing information about the training
     process and the trained model.
@@ -208,11 +399,11 @@ def train_and_test(
     # Parameter grid for the classifier, but also for the 'pre-processing'
     # of a kernel matrix.
     param_grid = {
-        'C': 10. ** np.arange(-3, 4),  # 10^{-3}..10^{3}
+        'C': 10. ** np.arange(-3, 4),  # 10^{-3}..10^{3}, ascending
         'normalize': [False, True]
     }
 
-    clf, K, best_parameters = grid_search_cv(
+    clf, K, best_parameters, K_train = grid_search_cv(
         SVC(
             class_weight='balanced',
             kernel='precomputed',
@@ -222,18 +413,26 @@ def train_and_test(
         train_indices,
         n_folds=5,
         param_grid=ParameterGrid(param_grid),
-        kernel_matrices=matrices
+        kernel_matrices=matrices,
+        n_jobs=n_jobs
     )
 
     # Refit the classifier on the test data set; using the kernel matrix
-    # that performed best in the hyperparameter search.
-    K_train = K[train_indices][:, train_indices]
+    # that performed best in the hyperparameter search. Normalizing only
+    # the required block avoids normalizing the whole matrix.
+    if best_parameters['normalize']:
+        K_test = normalize_block(K, test_indices, train_indices)
+    else:
+        K_test = K[np.ix_(test_indices, train_indices)]
+
+    K_train = np.asarray(K_train, dtype=np.float64)
+    K_test = np.asarray(K_test, dtype=np.float64)
+
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=ConvergenceWarning)
         clf.fit(K_train, y[train_indices])
 
     y_test = y[test_indices]
-    K_test = K[test_indices][:, train_indices]
     y_pred = clf.predict(K_test)
     y_score = clf.predict_proba(K_test)
 
@@ -253,39 +452,57 @@ def train_and_test(
 
         # This ensures that column $i$ can be used to access all labels
         # of the same class.
-        y_test_binarized = label_binarize(
-            y_test,
-            classes=classes
-        )
-
-        aurocs = []
-        auprcs = []
+        if y_test_binarized is None:
+            y_test_binarized = label_binarize(
+                y_test,
+                classes=classes
+            )
 
         # In some cases, scores cannot be returned for each of the
         # classes because the number of instances is insufficient.
         n_scores = min(n_classes, y_score.shape[1])
 
-        for i in range(n_scores):
-            try:
-                auroc = roc_auc_score(
-                    y_test_binarized[:, i],
-                    y_score[:, i],
-                )
-                auprc = average_precision_score(
-                    y_test_binarized[:, i],
-                    y_score[:, i]
-                )
+        # Calculate the macro average over all classes at once. This
+        # fails if the test data set does not contain both positive and
+        # negative instances for every class; only then do we need to
+        # check the classes individually.
+        try:
+            auroc = roc_auc_score(
+                y_test_binarized[:, :n_scores],
+                y_score[:, :n_scores],
+                average='macro'
+            )
+            auprc = average_precision_score(
+                y_test_binarized[:, :n_scores],
+                y_score[:, :n_scores],
+                average='macro'
+            )
+
+        except ValueError:
+            aurocs = []
+            auprcs = []
+
+            for i in range(n_scores):
+                try:
+                    auroc = roc_auc_score(
+                        y_test_binarized[:, i],
+                        y_score[:, i],
+                    )
+                    auprc = average_precision_score(
+                        y_test_binarized[:, i],
+                        y_score[:, i]
+                    )
 
-                aurocs.append(auroc)
-                auprcs.append(auprc)
+                    aurocs.append(auroc)
+                    auprcs.append(auprc)
 
-            # Ignore errors in the calculation and do *not* include the
-            # results in the subsequent mean calculation.
-            except ValueError:
-                pass
+                # Ignore errors in the calculation and do *not* include
+                # the results in the subsequent mean calculation.
+                except ValueError:
+                    pass
 
-        auroc = np.mean(aurocs)
-        auprc = np.mean(auprcs)
+            auroc = np.mean(aurocs)
+            auprc = np.mean(auprcs)
 
     results = {
         'best_model': best_parameters,
@@ -336,6 +553,15 @@ if __name__ == '__main__':
         help='Maximum number of iterations to use for training',
         default=int(1e5)
     )
+    parser.add_argument(
+        '-j', '--n-jobs',
+        type=int,
+        help='Number of jobs for training and testing; -1 uses all '
+             'processors. Every job holds the training sub-matrices of all '
+             'kernel matrices, so memory grows with the number of jobs. '
+             'Defaults to the number of processors allocated by LSF, or 1.',
+        default=int(os.environ.get('LSB_DJOB_NUMPROC', 1))
+    )
 
     args = parser.parse_args()
 
@@ -363,7 +589,7 @@ has been specified.
     # a certain input data set.
     matrices = {
         os.path.splitext(os.path.basename(filename))[0]:
-            np.load(filename) for filename in tqdm(args.MATRIX, desc='File')
+            load_matrices(filename) for filename in tqdm(args.MATRIX, desc='File')
     }
 
     logging.info('Checking input data and preparing splits...')
@@ -381,20 +607,18 @@ has been specified.
         for parameter in matrix:
 
             M = matrix[parameter]
-            print("m", M.shape)
+            logging.debug(f'{name}:{parameter} shape={M.shape}')
+
             if parameter != 'y':
                 # A kernel matrix needs to be square
                 assert M.shape[0] == M.shape[1]
-            else:
-                if y is None:
-                    y = M
-                else:
-                    assert y.shape == M.shape
+            elif y is None:
+                y = M
 
             # Either set the number of graphs, or check that each matrix
-            # contains the same number of them.
-            print(n_graphs)
-            print(M.shape)
+            # contains the same number of them. Since label vectors are
+            # one-dimensional, this also checks that all of them have
+            # the same shape.
             if n_graphs is None:
                 n_graphs = M.shape[0]
             else:
@@ -419,101 +643,141 @@ has been specified.
     # Prepare time measurement
     start_time = timer()
 
-    for name, matrix in matrices.items():
+    # Every matrix, i.e. every kernel, gets the *same* folds so that
+    # these results do not have to be stored multiple times. Yet, we
+    # have to re-initialize this based on the iteration, for we want
+    # different splits there.
+    folds = []
+    for iteration in range(n_iterations):
+        cv = StratifiedKFold(
+            n_splits=n_folds,
+            shuffle=True,
+            random_state=42 + iteration  # TODO: make configurable?
+        )
 
-        logging.info(f'Kernel name: {name}')
+        folds.append([
+            (all_indices[train_index], all_indices[test_index])
+            for train_index, test_index in cv.split(all_indices, y)
+        ])
+
+    # The binarized labels of a test data set are only required in the
+    # multi-class setting. They are the same for all kernels, so they
+    # are only calculated once per fold.
+    y_test_binarized = {
+        (iteration, fold_index): label_binarize(
+            y[test_indices], classes=classes
+        ) if len(classes) > 2 else None
+        for iteration in range(n_iterations)
+        for fold_index, (_, test_indices) in enumerate(folds[iteration])
+    }
 
-        for iteration in range(n_iterations):
+    jobs = [
+        (name, iteration, fold_index, train_indices, test_indices)
+        for name in matrices
+        for iteration in range(n_iterations)
+        for fold_index, (train_indices, test_indices) in
+        enumerate(folds[iteration])
+    ]
+
+    logging.info(f'Training and testing {len(jobs)} configurations...')
+
+    # Main function for training and testing a certain kernel matrix on
+    # the data set. All combinations of kernels, iterations, and folds
+    # are independent of each other, so they are processed in parallel.
+    # Labels and classes need to be passed explicitly because the jobs
+    # may run in another process.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        # Compressed files cannot be memory-mapped, so the kernel matrices
+        # are stored uncompressed in a temporary directory. Memory-mapped
+        # arrays are passed to the jobs by reference, so all of them share
+        # the same copy instead of receiving their own. This is not needed
+        # if everything runs in this process.
+        if effective_n_jobs(args.n_jobs) > 1:
+            for name, matrix in matrices.items():
+                for index, parameter in enumerate(matrix):
+                    if parameter != 'y':
+                        filename = os.path.join(
+                            tmp_dir, f'{name}_{index}.npy'
+                        )
+                        np.save(filename, matrix[parameter])
+                        matrix[parameter] = np.load(filename, mmap_mode='r')
+
+        all_fold_results = Parallel(n_jobs=args.n_jobs, verbose=10)(
+            delayed(train_and_test)(
+                train_indices,
+                test_indices,
+                matrices[name],
+                y,
+                classes,
+                args.max_iterations,
+                y_test_binarized=y_test_binarized[iteration, fold_index]
+            ) for name, iteration, fold_index, train_indices, test_indices
+            in jobs
+        )
 
-            logging.info(f'Iteration {iteration + 1}/{n_iterations}')
+    for (name, iteration, fold_index, train_indices, test_indices), \
+            results in zip(jobs, all_fold_results):
 
-            # Every matrix, i.e. every kernel, gets the *same* folds so that
-            # these results do not have to be stored multiple times. Yet, we
-            # have to re-initialize this based on the iteration, for we want
-            # different splits there.
-            cv = StratifiedKFold(
-                n_splits=n_folds,
-                shuffle=True,
-                random_state=42 + iteration  # TODO: make configurable?
-            )
+        # We already have information about the folds for this
+        # particular iteration. This works because each kernel
+        # is shown the *same* folds.
+        if iteration in all_results['iterations'].keys():
+            pass
 
-            for fold_index, (train_index, test_index) in \
-                    enumerate(cv.split(all_indices, y)):
+        # Store information about indices and labels. This has
+        # to be done only for the first kernel matrix.
+        else:
+            all_results['iterations'][iteration] = {
+                'folds': collections.defaultdict(dict)
+            }
 
-                logging.info(f'Processing fold {fold_index + 1}/{n_folds}...')
+        # Add fold information; this might overwrite one that is
+        # already stored, but since all folds are the same, this
+        # is not a problem.
+        per_fold = all_results['iterations'][iteration]['folds']
 
-                # These indices do *not* change for individual kernels,
-                # but we will overwrite them nonetheless.
-                train_indices = all_indices[train_index]
-                test_indices = all_indices[test_index]
+        if args.with_indices:
+            per_fold[fold_index]['train_indices'] = train_indices.tolist()
+            per_fold[fold_index]['test_indices'] = test_indices.tolist()
 
-                # Main function for training and testing a certain kernel
-                # matrix on the data set.
-                results = train_and_test(
-                    train_indices,
-                    test_indices,
-                    matrix,
-                    classes,
-                    args.max_iterations
-                )
+        per_fold[fold_index]['y_test'] = y[test_indices].tolist()
 
-                # We already have information about the folds for this
-                # particular iteration. This works because each kernel
-                # is shown the *same* folds.
-                if iteration in all_results['iterations'].keys():
-                    pass
+        # Prepare results for the current fold of the current
+        # iteration. This will collect individual values, and
+        # thus make it necessary to sum/collate over axes.
+        #
+        # We take whatever information has been supplied by the
+        # function above.
+        fold_results = {
+            key: value for key, value in results.items()
+        }
+
+        # Check whether we are already storing information about
+        # kernels.
+        if 'kernels' not in per_fold[fold_index].keys():
+            per_fold[fold_index]['kernels'] = {}
+
+        kernel_results = per_fold[fold_index]['kernels']
 
-                # Store information about indices and labels. This has
-                # to be done only for the first kernel matrix.
-                else:
-                    all_results['iterations'][iteration] = {
-                        'folds': collections.defaultdict(dict)
-                    }
-
-                # Add fold information; this might overwrite one that is
-                # already stored, but since all folds are the same, this
-                # is not a problem.
-                per_fold = all_results['iterations'][iteration]['folds']
-
-                if args.with_indices:
-                    per_fold[fold_index]['train_indices'] = train_indices.tolist()
-                    per_fold[fold_index]['test_indices'] = test_indices.tolist()
-
-                per_fold[fold_index]['y_test'] = y[test_indices].tolist()
-
-                # Prepare results for the current fold of the current
-                # iteration. This will collect individual values, and
-                # thus make it necessary to sum/collate over axes.
-                #
-                # We take whatever information has been supplied by the
-                # function above.
-                fold_results = {
-                    key: value for key, value in results.items()
-                }
-
-                # Check whether we are already storing information about
-                # kernels.
-                if 'kernels' not in per_fold[fold_index].keys():
-                    per_fold[fold_index]['kernels'] = {}
-
-                kernel_results = per_fold[fold_index]['kernels']
-
-                # The results for this kernel on this particular fold
-                # must not have been reported anywhere else.
-                assert name not in kernel_results.keys()
-
-                kernel_results[name] = {
-                    key: value for key, value in fold_results.items()
-                }
+        # The results for this kernel on this particular fold
+        # must not have been reported anywhere else.
+        assert name not in kernel_results.keys()
 
+        kernel_results[name] = {
+            key: value for key, value in fold_results.items()
+        }
+
+    # This is the wall-clock time of the whole run; with more than one
+    # job, it is *not* the sum of the run times of the individual jobs.
     all_results['runtime'] = timer() - start_time
     all_results['max_iterations'] = args.max_iterations
 
     # The check for overwriting this data is only done once. If we have
     # arrived here, we might just as well write out our results.
+    #
+    # Without indentation, `json.dumps` uses the C implementation of the
+    # encoder, whereas `json.dump` with indentation always falls back to
+    # the much slower Python implementation.
     with open(args.output, 'w') as f:
-        json.dump(
-            all_results,
-            f,
-            indent=4
-        )
+        f.write(json.dumps(all_results))